@@ -0,0 +1,112 @@
+import hashlib
+import time
+from decimal import Decimal, ROUND_HALF_UP
+from django.template.loader import render_to_string
+from drinkers.lru import LRU
+from drinkers.models import Recommendation
+
+
+class RecommendationCache(object):
+    '''
+    A bounded LRU cache of recommendation results.
+
+    Entries are keyed on the drink preference and the target alcohol percentage quantized to the resolution of
+    Recommendation.alcohol_percentage, so repeat targets skip both the database query and the rendering of the
+    drink fragment. Each entry holds the set of recommendations tied for the closest alcohol percentage, along with
+    one pre-rendered fragment per recommendation.
+
+    Recommendations are changed with loaddata or a shell, i.e. outside the server process, so the cache cannot rely on
+    model signals. Instead, at most once every check_interval seconds it fingerprints every row of the
+    drinkers_recommendation table, which only holds a few hundred rows, and clears itself if the fingerprint differs
+    from the one it was filled from.
+    '''
+
+    def __init__(self, max_size=256, check_interval=10, fragment_template='recommendation_drink.html'):
+        '''
+        Input:
+        - max_size: Maximum number of (preference, target) entries to keep before evicting the least recently used.
+        - check_interval: Minimum number of seconds between two fingerprints of the table.
+        - fragment_template: Template used to pre-render the drink fragment of each recommendation.
+        '''
+        self.check_interval = check_interval
+        self.fragment_template = fragment_template
+        decimal_places = Recommendation._meta.get_field('alcohol_percentage').decimal_places
+        self.resolution = Decimal(1).scaleb(-decimal_places)
+        self.entries = LRU(max_size)
+        self.version = None
+        self.checked_at = None
+
+    def quantize(self, percent_alcohol):
+        '''
+        Round a target alcohol percentage to the resolution of the catalog.
+        '''
+        return Decimal(repr(float(percent_alcohol))).quantize(self.resolution, rounding=ROUND_HALF_UP)
+
+    def get(self, drink_preference, percent_alcohol):
+        '''
+        Look up the recommendations closest to a target alcohol percentage.
+
+        Input:
+        - drink_preference: One of the keys of DRINK_PREFERENCES.
+        - percent_alcohol: The target alcohol percentage.
+
+        Output:
+        A list of (recommendation, fragment) tuples, one for each recommendation tied for the closest alcohol
+        percentage. The list is empty if there are no recommendations for the given preference.
+        '''
+        self.check_version()
+
+        key = (drink_preference, self.quantize(percent_alcohol))
+        entry = self.entries.get(key)
+        if entry is not None:
+            return entry
+
+        ## a load that overlaps clear() is not cached
+        generation = self.entries.generation
+        entry = self.load(*key)
+        self.entries.put(key, entry, generation)
+        return entry
+
+    def load(self, drink_preference, percent_alcohol):
+        '''
+        Query the database for the recommendations tied for the closest alcohol percentage and render their
+        fragments.
+        '''
+        recommendations = Recommendation.objects.raw(
+            '''SELECT d.* FROM drinkers_recommendation d
+               WHERE ABS(d.alcohol_percentage - %s) = (
+                SELECT MIN(ABS(d2.alcohol_percentage - %s))
+                FROM drinkers_recommendation d2
+                WHERE action_type = %s
+            ) AND action_type = %s''',
+            [percent_alcohol, percent_alcohol, drink_preference, drink_preference]
+        )
+        return [
+            (rec, render_to_string(self.fragment_template, {'recommendation': rec}))
+            for rec in recommendations
+        ]
+
+    def check_version(self):
+        '''
+        Clear the cache if any row of the drinkers_recommendation table changed since the last check. The table is
+        queried at most once every check_interval seconds.
+        '''
+        now = time.time()
+        if self.checked_at is not None and now - self.checked_at < self.check_interval:
+            return
+        self.checked_at = now
+
+        rows = Recommendation.objects.order_by('id').values_list('id', 'action_type', 'name', 'alcohol_percentage')
+        version = hashlib.sha1(repr(list(rows)).encode('utf-8')).hexdigest()
+        if version != self.version:
+            self.clear()
+            self.version = version
+
+    def clear(self):
+        '''
+        Drop all cached entries.
+        '''
+        self.entries.clear()
+
+
+recommendation_cache = RecommendationCache()
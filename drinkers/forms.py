@@ -19,7 +19,7 @@ class DrinkerForm(forms.Form):
         return Drinker(
             name=self.cleaned_data['name'],
             weight=self.cleaned_data['weight'],
-            gender=self.cleaned_data['male'],
+            gender=self.cleaned_data['male'] == 'True',
             hunger=self.cleaned_data['hunger'],
             tolerance=self.cleaned_data['tolerance'],
             drink_preference=self.cleaned_data['drink_preference']
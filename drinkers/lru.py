@@ -0,0 +1,54 @@
+import threading
+from collections import OrderedDict
+
+
+class LRU(object):
+    '''
+    A thread-safe mapping that keeps at most max_size entries, evicting the least recently used.
+
+    clear() bumps a generation counter. Callers that load a value outside the lock can pass the generation they
+    started from to put(), so values loaded before a clear are dropped instead of cached.
+    '''
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.generation = 0
+
+    def get(self, key):
+        '''
+        Look up a value and mark it as most recently used. Returns None if the key is not cached.
+        '''
+        with self.lock:
+            value = self.entries.pop(key, None)
+            if value is not None:
+                self.entries[key] = value
+            return value
+
+    def put(self, key, value, generation=None):
+        '''
+        Cache a value as the most recently used, unless generation is given and the cache was cleared since.
+        '''
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            self.entries.pop(key, None)
+            self.entries[key] = value
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def keys(self):
+        '''
+        Cached keys, from least to most recently used.
+        '''
+        with self.lock:
+            return list(self.entries.keys())
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.generation += 1
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,43 @@
+import time
+from optparse import make_option
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from lib.arduino_devices import Acceleralizer, device_lock, secs_since_measured
+
+
+class Command(BaseCommand):
+    help = ('Update the rolling sober baseline of the Acceleralizer from idle readings. '
+            'Run it with --interval next to the server to calibrate between measurements.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--secs', type='float', default=10,
+                    help='Seconds to read idle observations for [default: %default]'),
+        make_option('--settle', type='float', default=30,
+                    help='Seconds to wait after a measurement for the sensor to recover [default: %default]'),
+        make_option('--interval', type='float', default=None,
+                    help='Calibrate every this many seconds instead of once'),
+    )
+
+    def handle(self, *args, **options):
+        while True:
+            self.stdout.write(self.calibrate(options['secs'], options['settle']))
+            if options['interval'] is None:
+                break
+            time.sleep(options['interval'])
+
+    def calibrate(self, secs, settle):
+        dev_path = settings.DEVICE_PATH
+        with device_lock(dev_path, blocking=False) as acquired:
+            if not acquired:
+                return 'Skipped: %s is measuring' % dev_path
+
+            since = secs_since_measured(dev_path)
+            if since is not None and since < settle:
+                return 'Skipped: %s was used %.0f seconds ago' % (dev_path, since)
+
+            device = Acceleralizer(dev_path, baseline_path=settings.BASELINE_PATH)
+            if not device.reader.ready:
+                return 'Skipped: %s not found' % dev_path
+            if not device.calibrate(secs):
+                return 'Rejected: no idle readings from %s' % dev_path
+            return 'Baseline of %s: %.1f' % (dev_path, device.baseline)
@@ -14,6 +14,7 @@ class Drinker(models.Model):
     hunger = models.IntegerField()
     tolerance = models.IntegerField()
     drink_preference = models.CharField(max_length=50, choices=DRINK_PREFERENCES)
+    token = models.CharField(max_length=8, unique=True)
 
 ACTION_TYPES = (
     ('sober', 'Sober'),
@@ -0,0 +1,85 @@
+from django.utils.crypto import get_random_string
+from drinkers.lru import LRU
+from drinkers.models import Drinker
+from lib.drink_action import DrinkAction
+
+TOKEN_LENGTH = 6
+
+## no 0/O or 1/I/L, so tokens are easy to read back at an event
+TOKEN_CHARS = 'ABCDEFGHJKMNPQRSTUVWXYZ23456789'
+
+
+class DrinkerProfiles(object):
+    '''
+    Saved drinker profiles, looked up by a short token.
+
+    Profiles are kept in an in-process LRU cache in front of the Drinker table. Saving a profile writes it through to
+    the database, and every cached profile carries a DrinkAction with its drinker-dependent inputs precomputed, so a
+    returning drinker only needs a new BAC measurement.
+    '''
+
+    def __init__(self, max_size=512):
+        '''
+        Input:
+        - max_size: Maximum number of profiles to keep in memory before evicting the least recently used.
+        '''
+        self.entries = LRU(max_size)
+
+    def get(self, token):
+        '''
+        Look up a saved profile.
+
+        Input:
+        - token: The token handed out when the profile was saved. Case is ignored.
+
+        Output:
+        A (drinker, action) tuple, or None if no profile was saved under the token.
+        '''
+        token = token.strip().upper()
+        entry = self.entries.get(token)
+        if entry is not None:
+            return entry
+
+        try:
+            drinker = Drinker.objects.get(token=token)
+        except Drinker.DoesNotExist:
+            return None
+        return self.put(drinker)
+
+    def save(self, drinker):
+        '''
+        Save a profile, assigning it a new token if it does not have one yet.
+
+        Input:
+        - drinker: A Drinker instance.
+
+        Output:
+        A (drinker, action) tuple.
+        '''
+        if not drinker.token:
+            drinker.token = self.new_token()
+        drinker.save()
+        return self.put(drinker)
+
+    def put(self, drinker):
+        entry = (drinker, DrinkAction(drinker))
+        self.entries.put(drinker.token, entry)
+        return entry
+
+    def new_token(self):
+        '''
+        Generate a token that is not in use yet.
+        '''
+        while True:
+            token = get_random_string(TOKEN_LENGTH, TOKEN_CHARS)
+            if not Drinker.objects.filter(token=token).exists():
+                return token
+
+    def clear(self):
+        '''
+        Drop all cached profiles.
+        '''
+        self.entries.clear()
+
+
+drinker_profiles = DrinkerProfiles()
@@ -1,3 +1,290 @@
+import datetime
+import json
+import os
+import shutil
+import tempfile
 from django.test import TestCase
+from pandas import DataFrame
+from drinkers.cache import RecommendationCache, recommendation_cache
+from drinkers.models import Drinker, Recommendation
+from drinkers.profiles import DrinkerProfiles, drinker_profiles
+from drinkers.views import DrinkerView
+from lib.arduino_devices import Acceleralizer
 
-# Create your tests here.
+
+class RecommendationCacheTest(TestCase):
+
+    def setUp(self):
+        Recommendation.objects.create(action_type='beer', name='Amstel Light', alcohol_percentage='3.5')
+        Recommendation.objects.create(action_type='beer', name='Alaskan Amber', alcohol_percentage='5.0')
+        Recommendation.objects.create(action_type='beer', name='Alaskan ESB', alcohol_percentage='5.0')
+        Recommendation.objects.create(action_type='wine', name='Riesling', alcohol_percentage='12.0')
+
+    def names(self, entry):
+        return sorted(rec.name for rec, fragment in entry)
+
+    def test_get_returns_tie_set_with_fragments(self):
+        cache = RecommendationCache()
+        entry = cache.get('beer', 4.8)
+        self.assertEqual(self.names(entry), ['Alaskan Amber', 'Alaskan ESB'])
+        for rec, fragment in entry:
+            self.assertIn(rec.name, fragment)
+
+    def test_quantized_hit_skips_query(self):
+        cache = RecommendationCache()
+        cache.get('beer', 5.001)
+        with self.assertNumQueries(0):
+            entry = cache.get('beer', 4.999)
+        self.assertEqual(self.names(entry), ['Alaskan Amber', 'Alaskan ESB'])
+
+    def test_lru_eviction(self):
+        cache = RecommendationCache(max_size=2)
+        cache.get('beer', 3.5)
+        cache.get('beer', 5.0)
+        ## touch 3.5 so that 5.0 becomes the least recently used
+        cache.get('beer', 3.5)
+        cache.get('wine', 12.0)
+        self.assertEqual(len(cache.entries), 2)
+        self.assertEqual(list(cache.entries.keys()), [
+            ('beer', cache.quantize(3.5)),
+            ('wine', cache.quantize(12.0)),
+        ])
+
+    def test_invalidated_after_recommendation_save(self):
+        cache = RecommendationCache(check_interval=0)
+        self.assertEqual(self.names(cache.get('beer', 4.6)), ['Alaskan Amber', 'Alaskan ESB'])
+        Recommendation.objects.create(action_type='beer', name='Alaskan Pale Ale', alcohol_percentage='4.6')
+        self.assertEqual(self.names(cache.get('beer', 4.6)), ['Alaskan Pale Ale'])
+
+    def test_invalidated_after_action_type_edit(self):
+        cache = RecommendationCache(check_interval=0)
+        self.assertEqual(self.names(cache.get('wine', 12.0)), ['Riesling'])
+        Recommendation.objects.filter(name='Riesling').update(action_type='liquor')
+        self.assertEqual(cache.get('wine', 12.0), [])
+
+    def test_invalidated_after_rename(self):
+        cache = RecommendationCache(check_interval=0)
+        cache.get('wine', 12.0)
+        Recommendation.objects.filter(name='Riesling').update(name='Gewurztraminer')
+        rec, fragment = cache.get('wine', 12.0)[0]
+        self.assertEqual(rec.name, 'Gewurztraminer')
+        self.assertIn('Gewurztraminer', fragment)
+
+    def test_invalidated_after_edits_cancelling_out(self):
+        cache = RecommendationCache(check_interval=0)
+        cache.get('beer', 5.0)
+        Recommendation.objects.filter(name='Amstel Light').update(alcohol_percentage='4.0')
+        Recommendation.objects.filter(name='Alaskan ESB').update(alcohol_percentage='4.5')
+        self.assertEqual(self.names(cache.get('beer', 5.0)), ['Alaskan Amber'])
+
+    def test_load_during_clear_is_not_cached(self):
+        cache = RecommendationCache()
+        load = cache.load
+
+        def load_and_clear(*args):
+            entry = load(*args)
+            cache.clear()
+            return entry
+
+        cache.load = load_and_clear
+        cache.get('beer', 5.0)
+        self.assertEqual(len(cache.entries), 0)
+
+
+class DrinkerProfilesTest(TestCase):
+
+    def new_drinker(self, name='Steve'):
+        return Drinker(name=name, weight=180, gender=True, hunger=1, tolerance=5, drink_preference='beer')
+
+    def test_save_and_get(self):
+        profiles = DrinkerProfiles()
+        drinker, action = profiles.save(self.new_drinker())
+        self.assertEqual(len(drinker.token), 6)
+        self.assertEqual(Drinker.objects.get(token=drinker.token).name, 'Steve')
+
+        with self.assertNumQueries(0):
+            cached, cached_action = profiles.get(drinker.token)
+        self.assertIs(cached, drinker)
+        self.assertIs(cached_action, action)
+
+    def test_get_ignores_case(self):
+        profiles = DrinkerProfiles()
+        drinker, action = profiles.save(self.new_drinker())
+        self.assertIs(profiles.get(' %s ' % drinker.token.lower())[0], drinker)
+
+    def test_get_falls_back_to_database(self):
+        profiles = DrinkerProfiles()
+        drinker, action = profiles.save(self.new_drinker())
+        profiles.clear()
+
+        loaded, loaded_action = profiles.get(drinker.token)
+        self.assertEqual(loaded.pk, drinker.pk)
+        self.assertEqual(loaded_action.get(0.05), action.get(0.05))
+
+    def test_get_unknown_token(self):
+        self.assertIsNone(DrinkerProfiles().get('NOPE'))
+
+    def test_lru_eviction(self):
+        profiles = DrinkerProfiles(max_size=2)
+        first = profiles.save(self.new_drinker('first'))[0]
+        second = profiles.save(self.new_drinker('second'))[0]
+        profiles.get(first.token)
+        third = profiles.save(self.new_drinker('third'))[0]
+        self.assertEqual(list(profiles.entries.keys()), [first.token, third.token])
+
+        ## evicted profiles are still in the database
+        self.assertEqual(profiles.get(second.token)[0].name, 'second')
+
+
+class DrinkerViewTest(TestCase):
+
+    def setUp(self):
+        Recommendation.objects.create(action_type='beer', name='Alaskan Amber', alcohol_percentage='5.0')
+        recommendation_cache.clear()
+        recommendation_cache.checked_at = None
+        drinker_profiles.clear()
+
+        ## skip the device, which would otherwise sleep through a random measurement
+        self.measurement = {'bac': 0.05, 'motion': 3, 'quality': True}
+        DrinkerView.measure = lambda view: self.measurement
+
+    def tearDown(self):
+        del DrinkerView.measure
+
+    def test_known_token(self):
+        drinker, action = drinker_profiles.save(
+            Drinker(name='Steve', weight=180, gender=True, hunger=1, tolerance=5, drink_preference='beer')
+        )
+        drinker_profiles.clear()
+
+        response = self.client.post('/drinkers/main', {'token': drinker.token.lower()})
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'recommendation.html')
+        self.assertEqual(response.context['drinker'].token, drinker.token)
+        self.assertContains(response, 'name="token" value="%s"' % drinker.token)
+        self.assertContains(response, 'Alaskan Amber')
+
+    def test_no_reading(self):
+        drinker, action = drinker_profiles.save(
+            Drinker(name='Steve', weight=180, gender=True, hunger=1, tolerance=5, drink_preference='beer')
+        )
+        self.measurement = {'bac': None, 'motion': None, 'quality': False}
+
+        response = self.client.post('/drinkers/main', {'token': drinker.token})
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'main.html')
+        self.assertContains(response, 'No reading from the breathalyzer')
+        self.assertContains(response, 'value="%s"' % drinker.token)
+
+    def test_unknown_token(self):
+        response = self.client.post('/drinkers/main', {'token': 'NOPE', 'name': 'Steve'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'main.html')
+        self.assertContains(response, 'Unknown token: NOPE')
+        ## fields typed in so far are kept, and not flagged as errors
+        self.assertContains(response, 'value="Steve"')
+        self.assertNotContains(response, 'This field is required')
+
+
+def readings(bac, x=None):
+    '''
+    A resampled-looking frame of Acceleralizer readings, one every 100 milliseconds.
+    '''
+    start = datetime.datetime(2014, 1, 1)
+    index = [start + datetime.timedelta(0, 0.1 * i) for i in range(len(bac))]
+    x = x if x is not None else [500] * len(bac)
+    return DataFrame({'x': x, 'y': [500] * len(bac), 'z': [400] * len(bac), 'bac': bac}, index=index)
+
+
+class AcceleralizerBaselineTest(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'baselines.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def device(self, dev_path='/dev/symposiarch-test'):
+        return Acceleralizer(dev_path, baseline_path=self.path)
+
+    def test_no_baseline(self):
+        self.assertIsNone(self.device().baseline)
+
+    def test_update_baseline_ewma(self):
+        device = self.device()
+        self.assertTrue(device.update_baseline(readings([100, 110, 120])))
+        self.assertEqual(device.baseline, 110)
+        self.assertTrue(device.update_baseline(readings([200, 210, 220])))
+        self.assertAlmostEqual(device.baseline, 0.9 * 110 + 0.1 * 210)
+
+    def test_update_baseline_rejects_breath(self):
+        device = self.device()
+        self.assertFalse(device.update_baseline(readings([100, 110, 400, 300])))
+        self.assertIsNone(device.baseline)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_baseline_file_round_trip_keeps_other_devices(self):
+        with open(self.path, 'w') as f:
+            json.dump({'/dev/other': 42.0}, f)
+
+        self.device().update_baseline(readings([100, 110, 120]))
+
+        self.assertEqual(self.device().baseline, 110)
+        self.assertEqual(self.device('/dev/other').baseline, 42.0)
+        with open(self.path) as f:
+            self.assertEqual(json.load(f), {'/dev/other': 42.0, '/dev/symposiarch-test': 110})
+        self.assertEqual(os.listdir(self.dir), ['baselines.json'])
+
+    def test_score_leaves_baseline_alone(self):
+        device = self.device()
+        device.update_baseline(readings([100, 110, 120]))
+        with open(self.path) as f:
+            saved = f.read()
+
+        device.score(readings([100] * 10 + [130] * 20))
+
+        self.assertEqual(device.baseline, 110)
+        with open(self.path) as f:
+            self.assertEqual(f.read(), saved)
+
+    def test_estimate_bac_without_baseline(self):
+        ## baseline from the window: 100 + 50
+        bac = self.device().estimate_bac(readings([100, 100, 600]))
+        self.assertAlmostEqual(bac, 450.0 / 750 * 0.3)
+
+    def test_estimate_bac_with_baseline(self):
+        device = self.device()
+        device.baseline = 50.0
+        ## stored baseline: 50 + 50, the window minimum is ignored
+        self.assertAlmostEqual(device.estimate_bac(readings([400, 600])), 500.0 / 800 * 0.3)
+        self.assertEqual(device.estimate_bac(readings([60, 90])), 0)
+
+
+class AcceleralizerScoreAllTest(TestCase):
+
+    def device(self):
+        return Acceleralizer('/dev/symposiarch-test', baseline_path=os.path.join(tempfile.gettempdir(), 'none.json'))
+
+    def test_still_window(self):
+        ## 3 seconds: a sober start, then a breath
+        result = self.device().score_all(readings([100] * 10 + [600] * 20, x=[500, 502] * 15))
+        self.assertAlmostEqual(result['bac'], 450.0 / 750 * 0.3)
+        self.assertEqual(result['motion'], 2)
+        self.assertTrue(result['quality'])
+
+    def test_short_window(self):
+        ## shorter than the 2 seconds discarded before scoring motion
+        result = self.device().score_all(readings([100, 100, 600]))
+        self.assertAlmostEqual(result['bac'], 450.0 / 750 * 0.3)
+        self.assertIsNone(result['motion'])
+        self.assertFalse(result['quality'])
+
+    def test_empty_window(self):
+        result = self.device().score_all(DataFrame([]))
+        self.assertEqual(result, {'bac': None, 'motion': None, 'quality': False})
+
+    def test_moving_window(self):
+        result = self.device().score_all(readings([100] * 30, x=[300, 700] * 15))
+        self.assertEqual(result['motion'], 400)
+        self.assertFalse(result['quality'])
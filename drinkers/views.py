@@ -1,12 +1,13 @@
 import random
+from django.conf import settings
 from django.core.urlresolvers import reverse_lazy
 from django.shortcuts import render_to_response
 from django.template import RequestContext
 from drinkers.forms import DrinkerForm
 from django.views.generic.edit import FormView
-from drinkers.models import Recommendation
-from lib.arduino_devices import Acceleralizer
-from lib.drink_action import DrinkAction
+from drinkers.cache import recommendation_cache
+from drinkers.profiles import drinker_profiles
+from lib.arduino_devices import Acceleralizer, device_lock, mark_measured
 
 STANDARD_PERCENT_ALCOHOL = {
     'beer': 5.0,
@@ -19,32 +20,54 @@ class DrinkerView(FormView):
     form_class = DrinkerForm
     success_url = reverse_lazy('recommendation')
 
+    def measure(self):
+        ## if device is not found, random BAC estimates will be  generated
+        ## hold the device so the calibrate command does not read this measurement
+        with device_lock(settings.DEVICE_PATH):
+            device = Acceleralizer(settings.DEVICE_PATH, baseline_path=settings.BASELINE_PATH)
+            ## with a rolling sober baseline only the exhale peak is needed
+            secs = 3 if device.baseline is not None else 5
+            measurement = device.measure(secs)
+            mark_measured(settings.DEVICE_PATH)
+        return measurement
+
+    def post(self, request, *args, **kwargs):
+        ## returning drinkers only send the token of their saved profile
+        token = request.POST.get('token', '').strip()
+        if token:
+            profile = drinker_profiles.get(token)
+            if profile is None:
+                ## keep whatever else was typed in, without validating it
+                form = self.form_class(initial=request.POST.dict())
+                return self.render_to_response(self.get_context_data(
+                    form=form, token_error='Unknown token: %s' % token
+                ))
+            return self.recommend(*profile)
+
+        return super(DrinkerView, self).post(request, *args, **kwargs)
+
     def form_valid(self, form):
-        drinker = form.to_drinker()
+        return self.recommend(*drinker_profiles.save(form.to_drinker()))
 
-        ## hard-code device path for now
-        ## if device is not found, random BAC estimates will be  generated
-        dev_path = '/dev/tty.usbmodem1411'
-        bac = Acceleralizer(dev_path).measure(5)
+    def recommend(self, drinker, action):
+        ## one read gives the BAC estimate along with the motion and signal quality scores
+        measurement = self.measure()
+        bac = measurement['bac']
+        if bac is None:
+            ## nothing readable came from the device, let the drinker try again with their token
+            return self.render_to_response(self.get_context_data(
+                form=self.form_class(), token=drinker.token,
+                device_error='No reading from the breathalyzer. Please try again.'
+            ))
 
-        action = DrinkAction(drinker, bac)
-        num_drinks = action.get()
+        num_drinks = action.get(bac)
         # convert num_drinks to alcohol percentage
         preferred_drink_alcohol = STANDARD_PERCENT_ALCOHOL.get(drinker.drink_preference)
         percent_alcohol = num_drinks * preferred_drink_alcohol
         # figure out what drink(s) to load?
-        recommendations = Recommendation.objects.raw(
-            '''SELECT d.* FROM drinkers_recommendation d
-               WHERE ABS(d.alcohol_percentage - %s) = (
-                SELECT MIN(ABS(d2.alcohol_percentage - %s))
-                FROM drinkers_recommendation d2
-                WHERE action_type = %s
-            ) AND action_type = %s''',
-            [percent_alcohol, percent_alcohol, drinker.drink_preference, drinker.drink_preference]
-        )
+        recommendations = recommendation_cache.get(drinker.drink_preference, percent_alcohol)
         # pick one at random
-        recs_list = list(recommendations)
-        rec = recs_list[random.randint(0, len(recs_list) - 1)]
+        rec, rec_fragment = random.choice(recommendations)
         # for recommendation in recommendations:
         #     rec = recommendation
 
@@ -55,6 +78,8 @@ class DrinkerView(FormView):
         return render_to_response('recommendation.html', {
             'drinker': drinker,
             'recommendation': rec,
+            'recommendation_fragment': rec_fragment,
             'num_drinks': num_drinks,
-            'bac': bac
+            'bac': bac,
+            'signal_ok': measurement['quality']
         }, context_instance=RequestContext(self.request))
@@ -1,9 +1,71 @@
 import datetime
+import fcntl
+import json
+import os
+import tempfile
+import threading
 import time
 import random
+from contextlib import contextmanager
 from pandas import DataFrame
 from arduino_reader import ArduinoReader
 
+## default location of the rolling baselines, next to manage.py
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'baselines.json')
+
+## serializes read-modify-write cycles on baseline files within this process
+baseline_lock = threading.Lock()
+
+
+def device_lock_path(dev_path, suffix='.lock'):
+    '''
+    Path of a file in the temporary directory that belongs to a device.
+    '''
+    return os.path.join(tempfile.gettempdir(), 'symposiarch' + dev_path.replace(os.sep, '_') + suffix)
+
+
+@contextmanager
+def device_lock(dev_path, blocking=True):
+    '''
+    Hold an exclusive lock on a device, across processes, so that a calibration never reads lines that belong to a
+    measurement. The device is opened when an ArduinoDevice is created, so create it inside the lock.
+
+    Input:
+    - dev_path: Path to the device
+    - blocking: Whether to wait for the lock if the device is in use.
+
+    Output:
+    Yields True if the lock was acquired, and False if blocking is False and the device is in use.
+    '''
+    with open(device_lock_path(dev_path), 'a') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def mark_measured(dev_path):
+    '''
+    Record that a device has just been used for a measurement.
+    '''
+    with open(device_lock_path(dev_path, '.measured'), 'w'):
+        pass
+
+
+def secs_since_measured(dev_path):
+    '''
+    Number of seconds since a device was last used for a measurement, or None if it never was.
+    '''
+    try:
+        return time.time() - os.path.getmtime(device_lock_path(dev_path, '.measured'))
+    except OSError:
+        return None
+
 
 class ArduinoDevice(object):
     '''
@@ -296,7 +358,9 @@ class Acceleralizer(ArduinoDevice):
     An Arduino accelerometer and breathalizer
     '''
 
-    def __init__(self, dev_path, port=9600, sample_freq='100l', discard_secs=0.5):
+    def __init__(self, dev_path, port=9600, sample_freq='100l', discard_secs=0.5,
+                 baseline_path=BASELINE_PATH, baseline_weight=0.1, idle_spread=50, motion_discard_secs=2,
+                 min_samples=5, max_motion=50):
         '''
         Input:
         - dev_path: Path to the device
@@ -306,12 +370,33 @@ class Acceleralizer(ArduinoDevice):
                        milliseconds.
         - discard_secs: The number of seconds to cut off from the beginning of the reading. The first few seconds
                         sometimes seem to contain noise.
+        - baseline_path: Path to a JSON file holding the rolling sober baseline of each device, keyed on dev_path.
+        - baseline_weight: Weight given to new idle readings when updating the rolling baseline.
+        - idle_spread: Maximum difference between the highest and the lowest reading of a calibration window. Readings
+                       within 50 of each other are normal for sober people, so a larger spread means somebody breathed
+                       into the device or it is still recovering from a measurement.
+        - motion_discard_secs: The number of seconds to cut off from the beginning of the reading before scoring
+                               motion. Same as the default of Accelerometer, whose first seconds are noisy.
+        - min_samples: Minimum number of resampled readings, after discarding, for a measurement to be considered
+                       reliable. The default is half a second of readings at the default sample_freq.
+        - max_motion: Maximum motion score for a measurement to be considered reliable. The device should be held
+                      still while breathing into it. There are no accelerometer recordings to calibrate this against
+                      yet; the default comes from the ADXL3xx data sheet. Powered at 5V, its output is about 0.1V
+                      per g, i.e. about 100 steps of the 10-bit analog reading per g, so 50 allows a swing of about
+                      half a g between the 10th and 90th percentile on any axis.
         '''
 
         super(Acceleralizer, self).__init__(dev_path=dev_path, port=port)
 
         self.sample_freq = sample_freq
         self.discard_secs = discard_secs
+        self.baseline_path = baseline_path
+        self.baseline_weight = baseline_weight
+        self.idle_spread = idle_spread
+        self.motion_discard_secs = motion_discard_secs
+        self.min_samples = min_samples
+        self.max_motion = max_motion
+        self.baseline = self.load_baseline()
 
     def parse_line(self, line):
         '''
@@ -334,6 +419,116 @@ class Acceleralizer(ArduinoDevice):
 
         return {'x': value[0], 'y': value[1], 'z': value[2], 'bac': value[3]}
 
+    def load_baseline(self):
+        '''
+        Load the rolling sober baseline for this device from baseline_path.
+
+        Output:
+        The baseline breathalizer reading, or None if no baseline has been recorded for this device yet.
+        '''
+
+        try:
+            with open(self.baseline_path) as f:
+                return json.load(f).get(self.dev_path)
+        except (IOError, ValueError):
+            return None
+
+    def save_baseline(self):
+        '''
+        Write the rolling sober baseline for this device to baseline_path, keeping the baselines of other devices.
+        '''
+
+        with baseline_lock:
+            try:
+                with open(self.baseline_path) as f:
+                    baselines = json.load(f)
+            except (IOError, ValueError):
+                baselines = {}
+
+            baselines[self.dev_path] = self.baseline
+
+            ## write to a unique temporary file in the same directory first, so a crash never leaves a half-written
+            ## file behind and concurrent writers never share a temporary file
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.baseline_path)))
+            with os.fdopen(fd, 'w') as f:
+                json.dump(baselines, f)
+            os.rename(tmp_path, self.baseline_path)
+
+    def update_baseline(self, df):
+        '''
+        Fold idle observations into the rolling sober baseline and persist it.
+
+        The baseline is an exponentially weighted moving average of the median reading of each window. Windows whose
+        readings spread over more than idle_spread are rejected, since they show a breath rather than an idle sensor.
+
+        Input:
+        - df: A resampled pandas DataFrame with a 'bac' column, recorded while nobody was blowing into the device.
+
+        Output:
+        True if the baseline was updated, False if the window was rejected.
+        '''
+
+        if len(df) == 0 or df.bac.max() - df.bac.min() > self.idle_spread:
+            return False
+
+        level = float(df.bac.median())
+        if self.baseline is None:
+            self.baseline = level
+        else:
+            self.baseline = (1 - self.baseline_weight) * self.baseline + self.baseline_weight * level
+
+        self.save_baseline()
+        return True
+
+    def calibrate(self, secs=10, discard_secs=2):
+        '''
+        Read idle observations from the device for a specified number of seconds and update the rolling sober
+        baseline with them. This is the only method that changes the baseline. It is meant to be run between
+        measurements, while nobody is blowing into the device, holding device_lock(); see the calibrate management
+        command.
+
+        Input:
+        - secs: Number of seconds to read from the device for.
+        - discard_secs: The number of seconds to cut off from the beginning of the reading. Opening the device
+                        resets the Arduino, so the first seconds are noisy.
+
+        Output:
+        True if the baseline was updated, False otherwise.
+        '''
+
+        if not self.reader.ready:
+            return False
+
+        lines = self.reader.read(secs=secs)
+        df = self.parse_lines(lines)
+        if len(df) == 0:
+            return False
+
+        df = df.resample(self.sample_freq, fill_method='pad')
+        return self.update_baseline(self.discard(df, discard_secs))
+
+    def resample(self, df):
+        '''
+        Resample a dataframe of records to evenly spaced readings and discard the first k seconds.
+        '''
+
+        ## resample to get evenly spaced readings
+        df = df.resample(self.sample_freq, fill_method='pad')
+
+        return self.discard(df, self.discard_secs)
+
+    @staticmethod
+    def discard(df, secs):
+        '''
+        Discard the first secs seconds of a dataframe of records.
+        '''
+
+        if len(df) == 0:
+            return df
+
+        min_t = min(df.index) + datetime.timedelta(0, secs)
+        return df[df.index >= min_t]
+
     def score(self, df):
         '''
         Given a set of observations from an Arduino accelerometer and a breathalizer, generate a score that estimates
@@ -348,16 +543,61 @@ class Acceleralizer(ArduinoDevice):
 
         '''
 
-        ## resample to get evenly spaced readings
+        df = self.resample(df)
+        return self.estimate_bac(df)
+
+    def score_all(self, df):
+        '''
+        Given a set of observations from an Arduino accelerometer and a breathalizer, estimate blood alcohol
+        concentration and score motion and signal quality, all from a single resampled window.
+
+        Input:
+        - df: A pandas DataFrame representing the data output by the device, with one column per variable and one
+              row per observations. Time stamps of the observations form the index of the DataFrame.
+
+        Output:
+        A dict with the following keys:
+        - bac: The estimated blood alcohol concentration. None if no line parsed, e.g. while the Arduino boots.
+        - motion: The Accelerometer score of the x, y and z readings, i.e. the maximum across the three axes of the
+                  difference between the 90th and the 10th percentile, after discarding the first
+                  motion_discard_secs seconds. None if there are too few readings.
+        - quality: True if both the BAC and the motion readings number at least min_samples and the motion score is
+                   at most max_motion.
+        '''
+
+        if len(df) == 0:
+            return {'bac': None, 'motion': None, 'quality': False}
+
+        ## resample once, then discard a different number of seconds for each score
         df = df.resample(self.sample_freq, fill_method='pad')
+        bac_df = self.discard(df, self.discard_secs)
+        motion_df = self.discard(df, self.motion_discard_secs)
 
-        ## discard first k seconds
-        min_t = min(df.index) + datetime.timedelta(0, self.discard_secs)
-        df = df[df.index >= min_t]
+        if len(bac_df) < self.min_samples or len(motion_df) < self.min_samples:
+            ## still give the best BAC estimate the readings allow
+            bac = self.estimate_bac(bac_df if len(bac_df) > 0 else df)
+            return {'bac': bac, 'motion': None, 'quality': False}
+
+        bac = self.estimate_bac(bac_df)
+        motion = max(motion_df[['x', 'y', 'z']].apply(Accelerometer.percentile_range))
+        quality = motion <= self.max_motion
+
+        return {'bac': bac, 'motion': motion, 'quality': quality}
+
+    def estimate_bac(self, df):
+        '''
+        Estimate blood alcohol concentration from a resampled dataframe of records.
+
+        If the device has a rolling sober baseline, only the exhale peak is needed. Otherwise the baseline is taken
+        from the minimum of the observations, which requires them to include some pre-exhale readings.
+        '''
 
-        ## readings within 50 of the minimum are normal for sober people
-        ## so we set the baseline at the minimum reading + 50
-        raw_min = df.bac.min() + 50
+        ## readings within 50 of the baseline are normal for sober people
+        ## so we set the baseline at the sober reading + 50
+        if self.baseline is None:
+            raw_min = df.bac.min() + 50
+        else:
+            raw_min = self.baseline + 50
 
         ## no readings below 0
         raw_range = max(df.bac.max() - raw_min, 0)
@@ -366,9 +606,27 @@ class Acceleralizer(ArduinoDevice):
         raw_range = min(raw_range, 900)
 
         ## scale raw values to BAC scale
-        bac = self.scale(raw_range, raw_min=raw_min, raw_max=900, scaled_min=0.0, scaled_max=0.3)
+        return self.scale(raw_range, raw_min=raw_min, raw_max=900, scaled_min=0.0, scaled_max=0.3)
+
+    def measure(self, secs):
+        '''
+        Read from the device for a specified number of seconds and score the output with score_all(), so a single
+        read yields both the BAC estimate and the motion score.
+
+        Input:
+        - secs: Number of seconds to read from the device for.
+
+        Output:
+        A dict as returned by score_all(). If the device is not found, the BAC estimate is random and motion and
+        quality are None.
+        '''
+
+        if self.reader.ready:
+            lines = self.reader.read(secs=secs)
+            return self.score_all(self.parse_lines(lines))
 
-        return bac
+        time.sleep(secs)
+        return {'bac': self.random_score(), 'motion': None, 'quality': None}
 
     def scale(self, raw_value, raw_min, raw_max, scaled_min, scaled_max):
         '''
@@ -382,4 +640,5 @@ class Acceleralizer(ArduinoDevice):
         - scaled_max: maximum value of output scale
         '''
 
-        return raw_value / (raw_max - raw_min) * (scaled_max - scaled_min)
\ No newline at end of file
+        ## raw readings are integers, so avoid integer division
+        return float(raw_value) / (raw_max - raw_min) * (scaled_max - scaled_min)
\ No newline at end of file
@@ -1,13 +1,15 @@
 class DrinkAction:
 
-    def __init__(self, drinker, bac):
+    def __init__(self, drinker):
         self.drinker = drinker
-        self.bac = float(bac)
 
-    def get(self):
+        ## everything that depends on the drinker alone is computed once,
+        ## so the same action can be reused for every measurement of a drinker
         hours = 1
         gender_constant = 0.58 if self.drinker.gender else 0.49
-        adjusted_weight = self.drinker.weight * 0.453592 * gender_constant
-        metabolized = (0.01 + 0.005 * self.drinker.tolerance) * hours
-        drinks = (0.138 - self.bac) * adjusted_weight / (0.806 * 1.2) - metabolized
+        self.adjusted_weight = self.drinker.weight * 0.453592 * gender_constant
+        self.metabolized = (0.01 + 0.005 * self.drinker.tolerance) * hours
+
+    def get(self, bac):
+        drinks = (0.138 - float(bac)) * self.adjusted_weight / (0.806 * 1.2) - self.metabolized
         return drinks
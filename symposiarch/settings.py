@@ -85,3 +85,11 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/1.6/howto/static-files/
 
 STATIC_URL = '/static/'
+
+
+# Acceleralizer device and its rolling sober baselines, keyed on device path
+# hard-code device path for now
+
+DEVICE_PATH = '/dev/tty.usbmodem1411'
+
+BASELINE_PATH = os.path.join(BASE_DIR, 'baselines.json')